@@ -1,16 +1,28 @@
 import streamlit as st
 import pandas as pd
+import numpy as np
 import os
 import re
+import codecs
 import zipfile
 import tempfile
 import io
-from openpyxl.styles import Border, Side, Alignment, Font, PatternFill
+import functools
+from openpyxl.styles import Border, Side, Alignment, Font, PatternFill, NamedStyle, DEFAULT_FONT
 from openpyxl.utils import get_column_letter
+from openpyxl.cell.cell import Cell
 
 # =========================
 # Helper Functions
 # =========================
+_SEQ_NUM_RE = re.compile(r"seq_num:(\d+)")
+_D_DATE_RE = re.compile(r"[-_]?D(?P<d>\d{6})", re.IGNORECASE)
+_JV_RE = re.compile(r"JV(?P<jv>\d{8})", re.IGNORECASE)
+_STRIP_D_RE = re.compile(r"[-_]?D\d{6}.*$", re.IGNORECASE)
+_GL_RE = re.compile(r"GL", re.IGNORECASE)
+_IMPLIED_DECIMAL_RE = re.compile(r"00[0-9]*")  # ASCII digits only (ให้ตรงกับที่ to_numeric parse ได้)
+
+@functools.lru_cache(maxsize=None)
 def excel_col_to_index(col_str: str) -> int:
     num = 0
     for c in col_str:
@@ -19,29 +31,46 @@ def excel_col_to_index(col_str: str) -> int:
         num = num * 26 + (ord(c.upper()) - ord("A")) + 1
     return num - 1
 
-def convert_implied_decimal(val):
+def convert_implied_decimal_series(series: pd.Series) -> pd.Series:
     """
-    แปลง implied decimal (หาร 100) เฉพาะกรณี:
+    แปลง implied decimal (หาร 100) ทั้งคอลัมน์ในครั้งเดียว (vectorized) เฉพาะกรณี:
     - เป็นเลขล้วน และ
     - มี "00" นำหน้า
     ถ้าไม่เข้าเงื่อนไข -> คืนค่าตรง ๆ (ไม่แปลง)
     """
+    s = series.astype(str).str.strip()
+    mask = s.str.fullmatch(_IMPLIED_DECIMAL_RE, na=False)
+    out = s.astype(object)
+    out[mask] = pd.to_numeric(s[mask], errors="coerce") / 100.0
+    return out
+
+def detect_text_encoding(file_path: str) -> str:
+    """
+    อ่าน bytes ของไฟล์ (ทีละ chunk) เพื่อเลือก encoding ก่อนส่งให้ read_csv
+    - decode เป็น UTF-8 ได้ทั้งไฟล์ -> "utf-8"
+    - ไม่ได้ -> "cp874" (ภาษาไทย)
+    """
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    try:
+        with open(file_path, "rb") as fh:
+            for chunk in iter(lambda: fh.read(1 << 20), b""):
+                decoder.decode(chunk)
+        decoder.decode(b"", final=True)
+    except UnicodeDecodeError:
+        return "cp874"
+    return "utf-8"
+
+def read_source_csv(file_path: str, usecols) -> pd.DataFrame:
+    """
+    อ่านไฟล์ source (csv/trf/txt) เป็น str_dtype
+    - ใช้ C engine เป็นหลัก (encoding จาก detect_text_encoding)
+    - ถ้า C engine parse ไม่ผ่าน (ParserError) ค่อย fallback ไป python engine
+    """
+    read_kwargs = dict(header=None, usecols=usecols, encoding=detect_text_encoding(file_path), dtype=str_dtype)
     try:
-        if val is None:
-            return val
-        val_str = str(val).strip()
-        if (not val_str.isdigit()) or (not val_str.startswith("00")):
-            return val_str
-        return float(val_str) / 100.0
-    except:
-        return val
-
-def extract_seq_num(val):
-    text = str(val)
-    match = re.search(r"seq_num:(\d+)", text)
-    if match:
-        return match.group(1)
-    return str(val).strip()
+        return pd.read_csv(file_path, engine="c", low_memory=False, **read_kwargs)
+    except pd.errors.ParserError:
+        return pd.read_csv(file_path, engine="python", **read_kwargs)
 
 def parse_dates_from_filename(filename: str):
     """
@@ -52,10 +81,10 @@ def parse_dates_from_filename(filename: str):
     """
     base = os.path.basename(filename)
 
-    d_match = re.search(r"[-_]?D(?P<d>\d{6})", base, flags=re.IGNORECASE)
+    d_match = _D_DATE_RE.search(base)
     d_date = d_match.group("d") if d_match else None
 
-    jv_match = re.search(r"JV(?P<jv>\d{8})", base, flags=re.IGNORECASE)
+    jv_match = _JV_RE.search(base)
     jv_date = None
     if jv_match:
         jv_full = jv_match.group("jv")  # YYYYMMDD
@@ -63,45 +92,35 @@ def parse_dates_from_filename(filename: str):
 
     return d_date, jv_date
 
-def pick_latest_files_by_duplicate_d_date(folder_path: str, files_list: list):
+def pick_latest_files_by_duplicate_d_date(files_list: list):
     """
     ถ้า D-date ซ้ำกัน ให้เลือกไฟล์ที่ JV-date (YYMMDD) มากที่สุด
-    รองรับไฟล์: .csv, .trf, .txt, .xls, .xlsx
+    files_list = [(full_path, filename), ...] ที่ extract แล้วและกรองนามสกุลมาแล้ว
+    (.csv, .trf, .txt, .xls, .xlsx)
     """
-    chosen = {}
-    valid_exts = (".csv", ".trf", ".txt", ".xls", ".xlsx")
-
-    for fn in files_list:
-        file_path = os.path.join(folder_path, fn)
-        if not fn.lower().endswith(valid_exts):
-            continue
-        if not os.path.isfile(file_path):
-            continue
-
-        d_date, jv_date = parse_dates_from_filename(fn)
-        jv_int = int(jv_date) if jv_date and jv_date.isdigit() else -1
-
-        if d_date is None:
-            key = f"__NO_D__::{fn}"
-            chosen[key] = {"file": file_path, "d_date": None, "jv_date": jv_date}
-            continue
-
-        if d_date not in chosen:
-            chosen[d_date] = {"file": file_path, "d_date": d_date, "jv_date": jv_date, "_jv_int": jv_int}
-        else:
-            if jv_int > chosen[d_date].get("_jv_int", -1):
-                chosen[d_date] = {"file": file_path, "d_date": d_date, "jv_date": jv_date, "_jv_int": jv_int}
-
-    results = []
-    for _, v in chosen.items():
-        v.pop("_jv_int", None)
-        results.append(v)
-
-    results.sort(key=lambda x: os.path.basename(x["file"]).lower())
-    return results
+    if not files_list:
+        return []
+
+    rows = [(full_path, fn, *parse_dates_from_filename(fn)) for full_path, fn in files_list]
+    files_df = pd.DataFrame(rows, columns=["file", "_name", "d_date", "jv_date"], dtype=object)
+    files_df["_jv_int"] = pd.to_numeric(files_df["jv_date"], errors="coerce").fillna(-1)
+
+    # D-date ซ้ำ -> เก็บ JV มากสุด (ถ้าเท่ากันเก็บไฟล์แรกที่เจอ), ไม่มี D-date -> เก็บทุกไฟล์
+    has_d = files_df["d_date"].notna()
+    latest = (
+        files_df[has_d]
+        .sort_values("_jv_int", ascending=False, kind="stable")
+        .drop_duplicates("d_date", keep="first")
+    )
+    chosen = pd.concat([latest, files_df[~has_d]])
+
+    chosen["_sort_name"] = chosen["_name"].str.lower()
+    chosen = chosen.sort_values("_sort_name", kind="stable")
+    chosen = chosen[["file", "d_date", "jv_date"]]
+    return chosen.where(chosen.notna(), None).to_dict("records")
 
 def strip_d_suffix_for_tlf_sheet(name_no_ext: str):
-    return re.sub(r"[-_]?D\d{6}.*$", "", name_no_ext, flags=re.IGNORECASE).strip()
+    return _STRIP_D_RE.sub("", name_no_ext).strip()
 
 def make_unique_sheet_name(book, desired_name: str):
     base = (desired_name or "Sheet")[:31]
@@ -113,21 +132,38 @@ def make_unique_sheet_name(book, desired_name: str):
         i += 1
     return name
 
-def max_k_from_searchkey(series: pd.Series) -> int:
+def make_search_key(series: pd.Series):
     """
-    หา max เลขท้ายของรูปแบบ xxxx|k จากคอลัมน์ _SearchKey
-    ถ้าไม่เจอคืน 1
+    สร้าง _SearchKey รูปแบบ xxxx|k (k = ลำดับที่ซ้ำของค่าเดียวกัน เริ่มที่ 1)
+    ได้ผลเหมือน groupby(series).cumcount() + 1 แต่ใช้ factorize + stable argsort แทน groupby
+    คืนค่า: (key_series, k_array) -> k_array.max() คือ max|k โดยไม่ต้อง parse key กลับ
     """
-    max_k = 1
-    try:
-        k_series = series.astype(str).str.extract(r"\|(\d+)\s*$")[0]
-        k_series = pd.to_numeric(k_series, errors="coerce")
-        max_k_val = k_series.max()
-        if pd.notna(max_k_val):
-            max_k = int(max_k_val)
-    except:
-        max_k = 1
-    return max_k
+    codes, _ = pd.factorize(series, sort=False)
+    n = len(codes)
+    if n == 0:
+        return series.astype(str), np.zeros(0, dtype=np.int64)
+
+    order = np.argsort(codes, kind="stable")
+    sorted_codes = codes[order]
+    run_start = np.r_[True, sorted_codes[1:] != sorted_codes[:-1]]
+    positions = np.arange(n)
+    local_idx = positions - np.maximum.accumulate(np.where(run_start, positions, 0))
+
+    cum = np.empty(n, dtype=np.int64)
+    cum[order] = local_idx + 1
+    return series + "|" + pd.Series(cum, index=series.index).astype(str), cum
+
+def lexsort_frame(df: pd.DataFrame, by: list) -> pd.DataFrame:
+    """
+    เรียง df จากน้อยไปมากตามคอลัมน์ใน by (เหมือน sort_values, ค่าว่างอยู่ท้าย)
+    ใช้ np.lexsort บน factorize codes แล้ว take ครั้งเดียว
+    """
+    keys = []
+    for col in reversed(by):
+        codes, uniques = pd.factorize(df[col], sort=True)
+        keys.append(np.where(codes < 0, len(uniques), codes))
+    order = np.lexsort(keys)
+    return df.take(order)
 
 # =========================
 # Config
@@ -135,6 +171,8 @@ def max_k_from_searchkey(series: pd.Series) -> int:
 tlf_reserved_rows = 2   # ขั้นต่ำ (แต่จะขยายตาม max "|k")
 gl_reserved_rows = 10   # ขั้นต่ำ (แต่จะขยายตาม max "|k")
 gap_rows = 3
+valid_source_exts = (".csv", ".trf", ".txt", ".xls", ".xlsx")
+str_dtype = "string[pyarrow]"  # dtype ข้อความของ DataFrame ที่อ่านเข้ามา (Arrow string kernels)
 exclude_tlf_columns = ["from_acct", "to_acct", "auth_branch_from"]
 
 TLF_LABEL = "Database(ATMI)"
@@ -154,12 +192,12 @@ tlf_columns_letters = [
 gl_indices = [excel_col_to_index(c) for c in gl_columns_letters]
 tlf_indices = [excel_col_to_index(c) for c in tlf_columns_letters]
 
+# ตำแหน่งคอลัมน์ใน DataFrame (usecols เรียงตาม index ของ Excel) -> คำนวณครั้งเดียว
+_tlf_sorted_letters = sorted(tlf_columns_letters, key=excel_col_to_index)
+_TLF_POS = {letter: i for i, letter in enumerate(_tlf_sorted_letters)}
+
 def get_col_pos_in_tlf(target_letter):
-    sorted_letters = sorted(tlf_columns_letters, key=lambda x: excel_col_to_index(x))
-    try:
-        return sorted_letters.index(target_letter)
-    except:
-        return -1
+    return _TLF_POS.get(target_letter, -1)
 
 pos_AZ = get_col_pos_in_tlf("AZ")
 pos_CU = get_col_pos_in_tlf("CU")
@@ -177,371 +215,394 @@ align_left = Alignment(horizontal="left", vertical="center")
 header_font = Font(bold=True)
 title_font = Font(bold=True, size=14, color="000000")
 search_fill = PatternFill(start_color="FFFF00", end_color="FFFF00", fill_type="solid")
+header_gray_fill = PatternFill(start_color="D9D9D9", end_color="D9D9D9", fill_type="solid")
+bold_italic_font = Font(bold=True, italic=True)
+search_ui_font = Font(bold=True, size=12)
+align_right_only = Alignment(horizontal="right")
+
+def register_named_styles(book):
+    """
+    ลงทะเบียน NamedStyle ที่ใช้กับตาราง (ครั้งเดียวต่อ workbook)
+    แต่ละ cell จะอ้างอิง style ตามชื่อ แทนการตั้ง border/alignment/number_format ทีละค่า
+    คืนค่า: {ชื่อ style: NamedStyle ที่ bind กับ book แล้ว}
+    """
+    styles = [
+        NamedStyle(name="hdr", font=header_font, border=thin_border, alignment=align_center),
+        NamedStyle(name="report_hdr", font=header_font, border=thin_border, alignment=align_center, fill=header_gray_fill),
+        NamedStyle(name="body_center", font=DEFAULT_FONT, border=thin_border, alignment=align_center),
+        NamedStyle(name="body_right", font=DEFAULT_FONT, border=thin_border, alignment=align_right),
+        NamedStyle(name="body_right_num", font=DEFAULT_FONT, border=thin_border, alignment=align_right, number_format="#,##0.00"),
+        NamedStyle(name="body_text_left", font=DEFAULT_FONT, border=thin_border, alignment=align_left, number_format="@"),
+        NamedStyle(name="body_text_center", font=DEFAULT_FONT, border=thin_border, alignment=align_center, number_format="@"),
+    ]
+    for style in styles:
+        book.add_named_style(style)
+    return {style.name: style for style in styles}
+
+def write_raw_table(ws, df, named_styles, col_styles, numeric_style=None):
+    """
+    เขียน df (header + data) ต่อท้ายแถวล่างสุดของ ws ด้วย ws.append พร้อม style ในรอบเดียว
+    - named_styles = ผลจาก register_named_styles
+    - col_styles[i] = ชื่อ NamedStyle ของคอลัมน์ i (None = ไม่ตั้ง style)
+    - numeric_style: ถ้าระบุ ค่าตัวเลขในคอลัมน์ "body_center" จะใช้ style นี้แทน
+    แต่ละ cell สร้างจาก style array ของ NamedStyle ที่ resolve ไว้ครั้งเดียว (ไม่ต้อง lookup ชื่อทุก cell)
+    """
+    header_style = named_styles["hdr"].as_tuple()
+    ws.append([Cell(ws, value=col_name, style_array=header_style) for col_name in df.columns])
+
+    col_arrays = [named_styles[name].as_tuple() if name else None for name in col_styles]
+    numeric_array = named_styles[numeric_style].as_tuple() if numeric_style else None
+
+    values = df.astype(object).where(df.notna(), None)
+    for row_values in values.itertuples(index=False, name=None):
+        row_cells = []
+        for value, style_name, style_array in zip(row_values, col_styles, col_arrays):
+            if numeric_array is not None and style_name == "body_center" and isinstance(value, (int, float)):
+                style_array = numeric_array
+            row_cells.append(Cell(ws, value=value, style_array=style_array))
+        ws.append(row_cells)
+
+def gl_column_style(col_name):
+    """
+    คืนชื่อ NamedStyle ของคอลัมน์ ATMI
+    """
+    if col_name in ["DR", "CR"]:
+        return "body_right_num"
+    if col_name == "Details":
+        return "body_text_left"
+    if col_name == "Seq":
+        return "body_text_center"
+    return "body_center"
 
 
 # =========================
 # Core Processing (In-Memory)
 # =========================
-def process_data_in_memory(db_path: str, source_files_list: list, temp_folder: str):
+def build_frames(item: dict, db_book):
+    """
+    เตรียมข้อมูลของไฟล์ source 1 ไฟล์: อ่าน Database sheet + source, clean, sort, _SearchKey
+    ไม่แตะ ExcelWriter -> แยกการเตรียมข้อมูลออกจากการเขียนชีท (write_sheet)
+    คืนค่า dict สำหรับส่งต่อให้ write_sheet
+    """
+    file_path = item["file"]
+    filename = os.path.basename(file_path)
+    chosen_d_date = item["d_date"]
+
+    desired_sheet_name = chosen_d_date if chosen_d_date else os.path.splitext(filename)[0]
+
+    clean_name = _GL_RE.sub("", filename)
+    clean_name = os.path.splitext(clean_name)[0].strip()
+    fallback_lookup_name = strip_d_suffix_for_tlf_sheet(clean_name)
+
+    db_lookup_candidates = []
+    if chosen_d_date:
+        db_lookup_candidates.append(chosen_d_date)
+        db_lookup_candidates.append("D" + chosen_d_date)
+    db_lookup_candidates.append(fallback_lookup_name)
+
+    db_sheet_to_use = None
+    for cand in db_lookup_candidates:
+        if cand and cand in db_book.sheet_names:
+            db_sheet_to_use = cand
+            break
+
+    # ---------- Load Database ----------
+    db_df = pd.DataFrame()
+    effective_db_reserved_rows = tlf_reserved_rows
+    max_k_db = 1
+
+    if db_sheet_to_use:
+        db_df = pd.read_excel(db_book, sheet_name=db_sheet_to_use, usecols=tlf_indices, dtype=str)
+        db_df = db_df.fillna("nan").astype(str_dtype).apply(lambda s: s.str.strip())
+
+        # implied decimal (only when startswith "00")
+        # แทนที่ทั้งคอลัมน์ตามตำแหน่ง (isetitem) -> ไม่ขึ้นกับชื่อ header และไม่ผ่าน iloc setitem
+        for pos in (pos_AZ, pos_CU):
+            if pos != -1 and pos < len(db_df.columns):
+                db_df.isetitem(pos, convert_implied_decimal_series(db_df.iloc[:, pos]))
+
+        # _SearchKey
+        if not db_df.empty and len(db_df.columns) > 8:
+            search_col = db_df.iloc[:, 8]
+            db_df["_SearchKey"], cum_db = make_search_key(search_col)
+
+            # ✅ ขยาย UI rows ตาม max|k (เหมือน GL_V4)
+            max_k_db = int(cum_db.max()) if len(cum_db) else 1
+            effective_db_reserved_rows = max(tlf_reserved_rows, max_k_db)
+
+    # ---------- Load Source (ATMI / GL) ----------
+    if filename.lower().endswith((".xls", ".xlsx")):
+        with pd.ExcelFile(file_path) as source_book:
+            raw_gl = pd.read_excel(source_book, header=None, usecols=gl_indices, dtype=str_dtype)
+    else:
+        raw_gl = read_source_csv(file_path, gl_indices)
+
+    # ✅ เหมือน GL_V4: ตั้งชื่อ source headers แล้วสร้าง Details/Seq จาก AZ_RAW
+    gl_source_headers = ["RC", "OC", "CH", "Product Code", "Account Code", "Tax", "DR", "CR", "AZ_RAW"]
+    if len(raw_gl.columns) == len(gl_source_headers):
+        raw_gl.columns = gl_source_headers
+    else:
+        # หากจำนวนคอลัมน์ไม่ตรง ให้พยายามตั้งชื่อเท่าที่ทำได้
+        raw_gl.columns = gl_source_headers[: len(raw_gl.columns)]
+
+    gl_df = raw_gl.copy()
+    if "AZ_RAW" in gl_df.columns:
+        gl_df["Details"] = gl_df["AZ_RAW"]
+        # ค่าว่างเป็นข้อความ "nan" (เหมือน astype(str) กับ object dtype)
+        az_raw = gl_df["AZ_RAW"].fillna("nan")
+        seq = az_raw.str.extract(_SEQ_NUM_RE, expand=False)
+        gl_df["Seq"] = seq.where(seq.notna(), az_raw.str.strip())
+    else:
+        gl_df["Details"] = ""
+        gl_df["Seq"] = ""
+
+    if "RC" in gl_df.columns:
+        gl_df["RC"] = gl_df["RC"].fillna("nan").str.strip()
+    if "CH" in gl_df.columns:
+        gl_df["CH"] = gl_df["CH"].fillna("nan").str.strip()
+
+    if "DR" in gl_df.columns:
+        gl_df["DR"] = pd.to_numeric(gl_df["DR"], errors="coerce").fillna(0)
+    if "CR" in gl_df.columns:
+        gl_df["CR"] = pd.to_numeric(gl_df["CR"], errors="coerce").fillna(0)
+
+    # ✅ คงลำดับคอลัมน์แบบ GL_V4
+    for col in gl_final_headers:
+        if col not in gl_df.columns:
+            gl_df[col] = ""
+    gl_df = gl_df[gl_final_headers]
+
+    # Sort
+    cols_to_sort = ["CH", "RC", "OC", "Product Code"]
+    valid_sort_cols = [c for c in cols_to_sort if c in gl_df.columns]
+    if valid_sort_cols:
+        gl_df = lexsort_frame(gl_df, valid_sort_cols)
+
+    # _SearchKey (GL)
+    effective_gl_reserved_rows = gl_reserved_rows
+    max_k_gl = 1
+    gl_search_key = None
+    if not gl_df.empty:
+        # เก็บแยกจาก gl_df (ไม่ export เป็นคอลัมน์ของตาราง) -> เขียนลงคอลัมน์ซ่อนทีหลัง
+        search_col_gl = gl_df["Seq"]
+        gl_search_key, cum_gl = make_search_key(search_col_gl)
+
+        # ✅ ขยาย UI rows ตาม max|k (เหมือน GL_V4)
+        max_k_gl = int(cum_gl.max()) if len(cum_gl) else 1
+        effective_gl_reserved_rows = max(gl_reserved_rows, max_k_gl)
+
+    return {
+        "sheet_name": desired_sheet_name,
+        "db_df": db_df,
+        "gl_df": gl_df,
+        "gl_search_key": gl_search_key,
+        "effective_db_reserved_rows": effective_db_reserved_rows,
+        "effective_gl_reserved_rows": effective_gl_reserved_rows,
+    }
+
+def write_sheet(writer, frames: dict, named_styles: dict):
+    """
+    เขียน layout (Search UI / Report / Raw data) ของ 1 ไฟล์ลงชีทใหม่ใน writer.book
+    ต้องเรียกทีละไฟล์ (openpyxl workbook ไม่ thread-safe)
+    """
+    db_df = frames["db_df"]
+    gl_df = frames["gl_df"]
+    gl_search_key = frames["gl_search_key"]
+    effective_db_reserved_rows = frames["effective_db_reserved_rows"]
+    effective_gl_reserved_rows = frames["effective_gl_reserved_rows"]
+
+    # ---------- Write Layout ----------
+    target_sheet_name = make_unique_sheet_name(writer.book, frames["sheet_name"])
+    worksheet = writer.book.create_sheet(target_sheet_name)
+    writer.sheets[target_sheet_name] = worksheet
+    ws = writer.sheets[target_sheet_name]
+
+    search_ui_start_row = 1
+    db_ui_height = 2 + (effective_db_reserved_rows if not db_df.empty else 0)
+    gl_ui_height = 2 + (effective_gl_reserved_rows if not gl_df.empty else 0)
+    raw_data_start_row = search_ui_start_row + db_ui_height + gap_rows + gl_ui_height + 5
+
+    current_raw_row = raw_data_start_row
+
+    # ranges
+    db_data_start = db_data_end = None
+    db_key_col_letter = "A"
+    gl_data_start = gl_data_end = None
+    gl_key_col_letter = "A"
+
+    # --- Raw Database ---
+    if not db_df.empty:
+        ws.cell(row=current_raw_row - 1, column=1, value=TLF_LABEL).font = bold_italic_font
+
+        db_data_start = current_raw_row + 1
+        db_data_end = current_raw_row + len(db_df)
+        db_key_col_letter = get_column_letter(len(db_df.columns))
+
+        # คอลัมน์สุดท้าย (_SearchKey) ไม่ตั้ง style
+        db_col_styles = ["body_text_center" if col == 9 else "body_center" for col in range(1, len(db_df.columns))]
+        db_col_styles.append(None)
+        write_raw_table(ws, db_df, named_styles, db_col_styles, numeric_style="body_right")
+        current_raw_row += len(db_df) + 4
+
+    # --- Raw ATMI ---
+    if not gl_df.empty:
+        ws.cell(row=current_raw_row - 1, column=1, value="--- Raw ATMI Data ---").font = bold_italic_font
+
+        gl_data_start = current_raw_row + 1
+        gl_data_end = current_raw_row + len(gl_df)
+
+        # style ต่อคอลัมน์คำนวณครั้งเดียว
+        gl_col_styles = [gl_column_style(c) for c in gl_df.columns]
+        write_raw_table(ws, gl_df, named_styles, gl_col_styles)
+
+        # _SearchKey (GL) -> คอลัมน์ซ่อน ถัดจากคอลัมน์ขวาสุดที่ใช้ในชีท
+        gl_key_col_idx = ws.max_column + 1
+        gl_key_col_letter = get_column_letter(gl_key_col_idx)
+        for row, key in enumerate(gl_search_key, gl_data_start):
+            ws.cell(row=row, column=gl_key_col_idx, value=key)
+        ws.column_dimensions[gl_key_col_letter].hidden = True
+
+    # --- Search UI ---
+    ws[f"A{search_ui_start_row}"] = "🔍 ค้นหาข้อมูล SEQ"
+    ws[f"A{search_ui_start_row}"].font = search_ui_font
+    ws[f"A{search_ui_start_row}"].alignment = align_right_only
+
+    input_cell_ref = f"$B${search_ui_start_row}"
+    input_cell = ws[f"B{search_ui_start_row}"]
+    input_cell.fill = search_fill
+    input_cell.border = thin_border
+    input_cell.alignment = align_center
+    input_cell.number_format = "@"
+
+    report_row = search_ui_start_row + 2
+
+    # --- Database Report ---
+    if not db_df.empty:
+        ws[f"A{report_row}"] = TLF_LABEL
+        ws[f"A{report_row}"].font = title_font
+
+        display_cols = [c for c in db_df.columns if c != "_SearchKey" and c not in exclude_tlf_columns]
+
+        # swap (as original)
+        if "amt_1_full" in display_cols and "resp_byte" in display_cols:
+            idx1 = display_cols.index("amt_1_full")
+            idx2 = display_cols.index("resp_byte")
+            display_cols[idx1], display_cols[idx2] = display_cols[idx2], display_cols[idx1]
+
+        db_key_range_str = f"${db_key_col_letter}${db_data_start}:${db_key_col_letter}${db_data_end}"
+
+        # range ของแต่ละคอลัมน์ไม่ขึ้นกับ r_offset -> คำนวณครั้งเดียว
+        display_col_letters = [get_column_letter(db_df.columns.get_loc(c) + 1) for c in display_cols]
+        data_col_ranges = [f"${l}${db_data_start}:${l}${db_data_end}" for l in display_col_letters]
+        formula_prefixes = ["=IFERROR(INDEX(" + rng + ", " for rng in data_col_ranges]
+
+        for i, col_name in enumerate(display_cols, 1):
+            ws.cell(row=report_row + 1, column=i, value=col_name).style = "report_hdr"
+
+        data_start_row = report_row + 2
+
+        # ✅ ใช้ effective_db_reserved_rows (ตาม max|k)
+        for r_offset in range(effective_db_reserved_rows):
+            current_formula_row = data_start_row + r_offset
+            k_value = r_offset + 1
+            # ส่วน MATCH(...) เหมือนกันทั้งแถว -> ต่อ string ครั้งเดียวต่อแถว
+            formula_suffix = "MATCH(" + input_cell_ref + '&"|"&' + str(k_value) + ", " + db_key_range_str + ', 0)), "")'
+
+            for i, prefix in enumerate(formula_prefixes, 1):
+                ws.cell(row=current_formula_row, column=i, value=prefix + formula_suffix).style = "body_center"
+
+        report_row = data_start_row + effective_db_reserved_rows
+
+    report_row += gap_rows
+
+    # --- ATMI Report ---
+    if not gl_df.empty:
+        ws[f"A{report_row}"] = "ATMI"
+        ws[f"A{report_row}"].font = title_font
+
+        gl_display_cols = list(gl_df.columns)
+        gl_display_styles = [gl_column_style(c) for c in gl_display_cols]
+
+        for i, col_name in enumerate(gl_display_cols, 1):
+            ws.cell(row=report_row + 1, column=i, value=col_name).style = "report_hdr"
+
+        data_start_row = report_row + 2
+
+        # MATCH กับคอลัมน์ _SearchKey ที่ซ่อนไว้
+        gl_key_range_str = f"${gl_key_col_letter}${gl_data_start}:${gl_key_col_letter}${gl_data_end}"
+
+        gl_data_col_ranges = [
+            f"${get_column_letter(i)}${gl_data_start}:${get_column_letter(i)}${gl_data_end}"
+            for i in range(1, len(gl_display_cols) + 1)
+        ]
+        gl_formula_prefixes = ["=IFERROR(INDEX(" + rng + ", " for rng in gl_data_col_ranges]
+
+        # ✅ ใช้ effective_gl_reserved_rows (ตาม max|k)
+        for r_offset in range(effective_gl_reserved_rows):
+            current_formula_row = data_start_row + r_offset
+            k_value = r_offset + 1
+            formula_suffix = "MATCH(" + input_cell_ref + '&"|"&' + str(k_value) + ", " + gl_key_range_str + ', 0)), "")'
+
+            for col_idx, (prefix, style_name) in enumerate(zip(gl_formula_prefixes, gl_display_styles), 1):
+                ws.cell(row=current_formula_row, column=col_idx, value=prefix + formula_suffix).style = style_name
+
+    # --- Smart Auto Width (with Details locked) ---
+    col_widths = {}
+
+    def update_max_width(df, start_col_idx=1, skip_cols=None):
+        skip_cols = set(skip_cols or [])
+        # ความยาว header + ความยาวข้อมูลสูงสุดของทุกคอลัมน์ คำนวณทั้ง df ในรอบเดียว
+        max_lens = np.array([len(str(c)) for c in df.columns])
+        if not df.empty:
+            data_lens = df.astype(str).apply(lambda s: s.str.len().max()).fillna(0).to_numpy()
+            max_lens = np.maximum(max_lens, data_lens)
+
+        for i, (col_name, max_len) in enumerate(zip(df.columns, max_lens)):
+            if col_name in skip_cols:
+                continue
+            current_idx = start_col_idx + i
+            existing = col_widths.get(current_idx, 0)
+            col_widths[current_idx] = max(existing, int(max_len) + 3)
+
+    if not db_df.empty:
+        update_max_width(db_df, start_col_idx=1)
+
+    if not gl_df.empty:
+        # skip Details to lock width later
+        update_max_width(gl_df, start_col_idx=1, skip_cols={"Details"})
+
+    # รวบความกว้างสุดท้ายของทุกคอลัมน์ก่อน แล้วค่อยตั้ง column_dimensions ครั้งเดียวต่อคอลัมน์
+    final_widths = {get_column_letter(col_idx): max(12, min(width, 60)) for col_idx, width in col_widths.items()}
+
+    # widen A,B
+    final_widths["A"] = max(col_widths.get(1, 20), 30)
+    final_widths["B"] = max(col_widths.get(2, 20), 25)
+
+    # lock Details width
+    if "Details" in gl_df.columns:
+        details_col_idx = gl_df.columns.get_loc("Details") + 1
+        final_widths[get_column_letter(details_col_idx)] = 12
+
+    dims = ws.column_dimensions
+    for col_letter, width in final_widths.items():
+        dims[col_letter].width = width
+
+def process_data_in_memory(db_path: str, source_files_list: list):
     output = io.BytesIO()
 
     try:
         with pd.ExcelFile(db_path) as db_book:
-            files_to_process = pick_latest_files_by_duplicate_d_date(temp_folder, source_files_list)
+            files_to_process = pick_latest_files_by_duplicate_d_date(source_files_list)
             if not files_to_process:
                 return None, "ไม่พบไฟล์ข้อมูล (GL/TRF/CSV/TXT/Excel) ที่ถูกต้องใน ZIP"
 
             with pd.ExcelWriter(output, engine="openpyxl") as writer:
-                for item in files_to_process:
-                    file_path = item["file"]
-                    filename = os.path.basename(file_path)
-                    chosen_d_date = item["d_date"]
-
-                    desired_sheet_name = chosen_d_date if chosen_d_date else os.path.splitext(filename)[0]
-
-                    clean_name = re.sub(r"GL", "", filename, flags=re.IGNORECASE)
-                    clean_name = os.path.splitext(clean_name)[0].strip()
-                    fallback_lookup_name = strip_d_suffix_for_tlf_sheet(clean_name)
-
-                    db_lookup_candidates = []
-                    if chosen_d_date:
-                        db_lookup_candidates.append(chosen_d_date)
-                        db_lookup_candidates.append("D" + chosen_d_date)
-                    db_lookup_candidates.append(fallback_lookup_name)
-
-                    db_sheet_to_use = None
-                    for cand in db_lookup_candidates:
-                        if cand and cand in db_book.sheet_names:
-                            db_sheet_to_use = cand
-                            break
+                named_styles = register_named_styles(writer.book)
 
+                # เตรียม DataFrame ของไฟล์ แล้วเขียนลง workbook ทีละไฟล์ (ถือ frame ไว้ทีละไฟล์เดียว)
+                for item in files_to_process:
                     try:
-                        # ---------- Load Database ----------
-                        db_df = pd.DataFrame()
-                        effective_db_reserved_rows = tlf_reserved_rows
-                        max_k_db = 1
-
-                        if db_sheet_to_use:
-                            db_df = pd.read_excel(
-                                db_book,
-                                sheet_name=db_sheet_to_use,
-                                usecols=tlf_indices,
-                                dtype=str,
-                            )
-                            for col in db_df.columns:
-                                db_df[col] = db_df[col].astype(str).str.strip()
-
-                            # implied decimal (only when startswith "00")
-                            if pos_AZ != -1 and pos_AZ < len(db_df.columns):
-                                db_df.iloc[:, pos_AZ] = db_df.iloc[:, pos_AZ].apply(convert_implied_decimal)
-                            if pos_CU != -1 and pos_CU < len(db_df.columns):
-                                db_df.iloc[:, pos_CU] = db_df.iloc[:, pos_CU].apply(convert_implied_decimal)
-
-                            # _SearchKey
-                            if not db_df.empty and len(db_df.columns) > 8:
-                                search_col = db_df.iloc[:, 8].astype(str).str.strip()
-                                db_df["_SearchKey"] = search_col + "|" + (db_df.groupby(search_col).cumcount() + 1).astype(str)
-
-                                # ✅ ขยาย UI rows ตาม max|k (เหมือน GL_V4)
-                                max_k_db = max_k_from_searchkey(db_df["_SearchKey"])
-                                effective_db_reserved_rows = max(tlf_reserved_rows, max_k_db)
-
-                        # ---------- Load Source (ATMI / GL) ----------
-                        if filename.lower().endswith((".xls", ".xlsx")):
-                            with pd.ExcelFile(file_path) as source_book:
-                                raw_gl = pd.read_excel(source_book, header=None, usecols=gl_indices, dtype=str)
-                        else:
-                            try:
-                                raw_gl = pd.read_csv(
-                                    file_path,
-                                    header=None,
-                                    usecols=gl_indices,
-                                    encoding="utf-8",
-                                    dtype=str,
-                                    engine="python",
-                                )
-                            except:
-                                raw_gl = pd.read_csv(
-                                    file_path,
-                                    header=None,
-                                    usecols=gl_indices,
-                                    encoding="cp874",
-                                    dtype=str,
-                                    engine="python",
-                                )
-
-                        # ✅ เหมือน GL_V4: ตั้งชื่อ source headers แล้วสร้าง Details/Seq จาก AZ_RAW
-                        gl_source_headers = ["RC", "OC", "CH", "Product Code", "Account Code", "Tax", "DR", "CR", "AZ_RAW"]
-                        if len(raw_gl.columns) == len(gl_source_headers):
-                            raw_gl.columns = gl_source_headers
-                        else:
-                            # หากจำนวนคอลัมน์ไม่ตรง ให้พยายามตั้งชื่อเท่าที่ทำได้
-                            raw_gl.columns = gl_source_headers[: len(raw_gl.columns)]
-
-                        gl_df = raw_gl.copy()
-                        if "AZ_RAW" in gl_df.columns:
-                            gl_df["Details"] = gl_df["AZ_RAW"]
-                            gl_df["Seq"] = gl_df["AZ_RAW"].apply(extract_seq_num).astype(str).str.strip()
-                        else:
-                            gl_df["Details"] = ""
-                            gl_df["Seq"] = ""
-
-                        if "RC" in gl_df.columns:
-                            gl_df["RC"] = gl_df["RC"].astype(str).str.strip()
-                        if "CH" in gl_df.columns:
-                            gl_df["CH"] = gl_df["CH"].astype(str).str.strip()
-
-                        if "DR" in gl_df.columns:
-                            gl_df["DR"] = pd.to_numeric(gl_df["DR"], errors="coerce").fillna(0)
-                        if "CR" in gl_df.columns:
-                            gl_df["CR"] = pd.to_numeric(gl_df["CR"], errors="coerce").fillna(0)
-
-                        # ✅ คงลำดับคอลัมน์แบบ GL_V4
-                        for col in gl_final_headers:
-                            if col not in gl_df.columns:
-                                gl_df[col] = ""
-                        gl_df = gl_df[gl_final_headers]
-
-                        # Sort
-                        cols_to_sort = ["CH", "RC", "OC", "Product Code"]
-                        valid_sort_cols = [c for c in cols_to_sort if c in gl_df.columns]
-                        if valid_sort_cols:
-                            gl_df = gl_df.sort_values(by=valid_sort_cols, ascending=[True] * len(valid_sort_cols))
-
-                        # _SearchKey (GL)
-                        effective_gl_reserved_rows = gl_reserved_rows
-                        max_k_gl = 1
-                        if not gl_df.empty:
-                            search_col_gl = gl_df["Seq"].astype(str)
-                            gl_df["_SearchKey"] = search_col_gl + "|" + (gl_df.groupby(search_col_gl).cumcount() + 1).astype(str)
-
-                            # ✅ ขยาย UI rows ตาม max|k (เหมือน GL_V4)
-                            max_k_gl = max_k_from_searchkey(gl_df["_SearchKey"])
-                            effective_gl_reserved_rows = max(gl_reserved_rows, max_k_gl)
-
-                        # ---------- Write Layout ----------
-                        target_sheet_name = make_unique_sheet_name(writer.book, desired_sheet_name)
-                        worksheet = writer.book.create_sheet(target_sheet_name)
-                        writer.sheets[target_sheet_name] = worksheet
-                        ws = writer.sheets[target_sheet_name]
-
-                        search_ui_start_row = 1
-                        db_ui_height = 2 + (effective_db_reserved_rows if not db_df.empty else 0)
-                        gl_ui_height = 2 + (effective_gl_reserved_rows if not gl_df.empty else 0)
-                        raw_data_start_row = search_ui_start_row + db_ui_height + gap_rows + gl_ui_height + 5
-
-                        current_raw_row = raw_data_start_row
-
-                        # ranges
-                        db_data_start = db_data_end = None
-                        db_key_col_letter = "A"
-                        gl_data_start = gl_data_end = None
-                        gl_key_col_letter = "A"
-
-                        # --- Raw Database ---
-                        if not db_df.empty:
-                            ws.cell(row=current_raw_row - 1, column=1, value=TLF_LABEL).font = Font(bold=True, italic=True)
-                            db_df.to_excel(writer, sheet_name=target_sheet_name, startrow=current_raw_row - 1, index=False)
-
-                            db_data_start = current_raw_row + 1
-                            db_data_end = current_raw_row + len(db_df)
-                            db_key_col_letter = get_column_letter(len(db_df.columns))
-
-                            for row in range(current_raw_row, db_data_end + 1):
-                                for col in range(1, len(db_df.columns)):
-                                    cell = ws.cell(row=row, column=col)
-                                    cell.border = thin_border
-                                    if row == current_raw_row:
-                                        cell.alignment = align_center
-                                        cell.font = header_font
-                                    else:
-                                        cell.alignment = align_right if isinstance(cell.value, (int, float)) else align_center
-                                        if col == 9:
-                                            cell.number_format = "@"
-                            current_raw_row += len(db_df) + 4
-
-                        # --- Raw ATMI ---
-                        if not gl_df.empty:
-                            ws.cell(row=current_raw_row - 1, column=1, value="--- Raw ATMI Data ---").font = Font(bold=True, italic=True)
-                            gl_df.to_excel(writer, sheet_name=target_sheet_name, startrow=current_raw_row - 1, index=False)
-
-                            gl_data_start = current_raw_row + 1
-                            gl_data_end = current_raw_row + len(gl_df)
-                            gl_key_col_letter = get_column_letter(len(gl_df.columns))  # includes _SearchKey too (because exported)
-
-                            # Styling
-                            for row in range(current_raw_row, gl_data_end + 1):
-                                for col in range(1, len(gl_df.columns) + 1):
-                                    cell = ws.cell(row=row, column=col)
-                                    cell.border = thin_border
-                                    if row == current_raw_row:
-                                        cell.alignment = align_center
-                                        cell.font = header_font
-                                    else:
-                                        col_name = gl_df.columns[col - 1]
-                                        if col_name in ["DR", "CR"]:
-                                            cell.alignment = align_right
-                                            cell.number_format = "#,##0.00"
-                                        elif col_name == "Details":
-                                            cell.alignment = align_left
-                                            cell.number_format = "@"
-                                        else:
-                                            cell.alignment = align_center
-                                        if col_name in ["Seq", "Details"]:
-                                            cell.number_format = "@"
-
-                        # --- Search UI ---
-                        ws[f"A{search_ui_start_row}"] = "🔍 ค้นหาข้อมูล SEQ"
-                        ws[f"A{search_ui_start_row}"].font = Font(bold=True, size=12)
-                        ws[f"A{search_ui_start_row}"].alignment = Alignment(horizontal="right")
-
-                        input_cell_ref = f"$B${search_ui_start_row}"
-                        input_cell = ws[f"B{search_ui_start_row}"]
-                        input_cell.fill = search_fill
-                        input_cell.border = thin_border
-                        input_cell.alignment = align_center
-                        input_cell.number_format = "@"
-
-                        report_row = search_ui_start_row + 2
-
-                        # --- Database Report ---
-                        if not db_df.empty:
-                            ws[f"A{report_row}"] = TLF_LABEL
-                            ws[f"A{report_row}"].font = title_font
-
-                            display_cols = [c for c in db_df.columns if c != "_SearchKey" and c not in exclude_tlf_columns]
-
-                            # swap (as original)
-                            if "amt_1_full" in display_cols and "resp_byte" in display_cols:
-                                idx1 = display_cols.index("amt_1_full")
-                                idx2 = display_cols.index("resp_byte")
-                                display_cols[idx1], display_cols[idx2] = display_cols[idx2], display_cols[idx1]
-
-                            db_key_range_str = f"${db_key_col_letter}${db_data_start}:${db_key_col_letter}${db_data_end}"
-
-                            for i, col_name in enumerate(display_cols, 1):
-                                cell = ws.cell(row=report_row + 1, column=i)
-                                cell.value = col_name
-                                cell.font = Font(bold=True)
-                                cell.border = thin_border
-                                cell.alignment = align_center
-                                cell.fill = PatternFill(start_color="D9D9D9", end_color="D9D9D9", fill_type="solid")
-
-                            data_start_row = report_row + 2
-
-                            # ✅ ใช้ effective_db_reserved_rows (ตาม max|k)
-                            for r_offset in range(effective_db_reserved_rows):
-                                current_formula_row = data_start_row + r_offset
-                                k_value = r_offset + 1
-                                match_logic = f'MATCH({input_cell_ref}&"|"&{k_value}, {db_key_range_str}, 0)'
-
-                                for i, col_name in enumerate(display_cols, 1):
-                                    original_col_idx = db_df.columns.get_loc(col_name)
-                                    col_letter = get_column_letter(original_col_idx + 1)
-                                    data_col_range = f"${col_letter}${db_data_start}:${col_letter}${db_data_end}"
-                                    formula = f'=IFERROR(INDEX({data_col_range}, {match_logic}), "")'
-
-                                    cell = ws.cell(row=current_formula_row, column=i)
-                                    cell.value = formula
-                                    cell.border = thin_border
-                                    cell.alignment = align_center
-
-                            report_row = data_start_row + effective_db_reserved_rows
-
-                        report_row += gap_rows
-
-                        # --- ATMI Report ---
-                        if not gl_df.empty:
-                            ws[f"A{report_row}"] = "ATMI"
-                            ws[f"A{report_row}"].font = title_font
-
-                            gl_display_cols = [c for c in gl_df.columns if c != "_SearchKey"]
-
-                            for i, col_name in enumerate(gl_display_cols, 1):
-                                cell = ws.cell(row=report_row + 1, column=i)
-                                cell.value = col_name
-                                cell.font = Font(bold=True)
-                                cell.border = thin_border
-                                cell.alignment = align_center
-                                cell.fill = PatternFill(start_color="D9D9D9", end_color="D9D9D9", fill_type="solid")
-
-                            data_start_row = report_row + 2
-
-                            # IMPORTANT: raw table includes _SearchKey col; key is last col
-                            # For matching, we need range of _SearchKey column specifically.
-                            # Find where _SearchKey was written in excel: it's the last column in exported gl_df.
-                            gl_key_col_excel = get_column_letter(len(gl_df.columns))
-                            gl_key_range_str = f"${gl_key_col_excel}${gl_data_start}:${gl_key_col_excel}${gl_data_end}"
-
-                            # ✅ ใช้ effective_gl_reserved_rows (ตาม max|k)
-                            for r_offset in range(effective_gl_reserved_rows):
-                                current_formula_row = data_start_row + r_offset
-                                k_value = r_offset + 1
-                                match_logic = f'MATCH({input_cell_ref}&"|"&{k_value}, {gl_key_range_str}, 0)'
-
-                                for col_idx, col_name in enumerate(gl_display_cols, 1):
-                                    col_letter = get_column_letter(col_idx)
-                                    data_col_range = f"${col_letter}${gl_data_start}:${col_letter}${gl_data_end}"
-                                    formula = f'=IFERROR(INDEX({data_col_range}, {match_logic}), "")'
-
-                                    cell = ws.cell(row=current_formula_row, column=col_idx)
-                                    cell.value = formula
-                                    cell.border = thin_border
-
-                                    if col_name in ["DR", "CR"]:
-                                        cell.number_format = "#,##0.00"
-                                        cell.alignment = align_right
-                                    elif col_name == "Details":
-                                        cell.number_format = "@"
-                                        cell.alignment = align_left
-                                    else:
-                                        cell.alignment = align_center
-
-                                    if col_name in ["Seq", "Details"]:
-                                        cell.number_format = "@"
-
-                        # --- Smart Auto Width (with Details locked) ---
-                        col_widths = {}
-
-                        def update_max_width(df, start_col_idx=1, skip_cols=None):
-                            skip_cols = set(skip_cols or [])
-                            for i, col_name in enumerate(df.columns):
-                                if col_name in skip_cols:
-                                    continue
-                                current_idx = start_col_idx + i
-                                max_len = len(str(col_name))
-                                if not df.empty:
-                                    try:
-                                        data_len = df[col_name].astype(str).map(len).max()
-                                        if pd.notna(data_len):
-                                            max_len = max(max_len, data_len)
-                                    except:
-                                        pass
-                                existing = col_widths.get(current_idx, 0)
-                                col_widths[current_idx] = max(existing, max_len + 3)
-
-                        if not db_df.empty:
-                            update_max_width(db_df, start_col_idx=1)
-
-                        if not gl_df.empty:
-                            # skip Details to lock width later
-                            update_max_width(gl_df, start_col_idx=1, skip_cols={"Details"})
-
-                        for col_idx, width in col_widths.items():
-                            col_letter = get_column_letter(col_idx)
-                            final_width = max(12, min(width, 60))
-                            writer.sheets[target_sheet_name].column_dimensions[col_letter].width = final_width
-
-                        # widen A,B
-                        writer.sheets[target_sheet_name].column_dimensions["A"].width = max(col_widths.get(1, 20), 30)
-                        writer.sheets[target_sheet_name].column_dimensions["B"].width = max(col_widths.get(2, 20), 25)
-
-                        # lock Details width
-                        if "Details" in gl_df.columns:
-                            details_col_idx = gl_df.columns.get_loc("Details") + 1
-                            details_col_letter = get_column_letter(details_col_idx)
-                            writer.sheets[target_sheet_name].column_dimensions[details_col_letter].width = 12
-
+                        write_sheet(writer, build_frames(item, db_book), named_styles)
                     except Exception:
                         # continue next file
                         pass
@@ -571,27 +632,25 @@ if uploaded_zip:
         with st.spinner("Extracting & Processing..."):
             with tempfile.TemporaryDirectory() as temp_dir:
                 try:
-                    # Extract ZIP
-                    with zipfile.ZipFile(uploaded_zip, "r") as zip_ref:
-                        zip_ref.extractall(temp_dir)
-
-                    # Identify files
+                    # Extract ZIP (เฉพาะไฟล์ Database และไฟล์ Source ที่รองรับ)
                     db_path = None
                     source_files = []
 
-                    for root, _, files in os.walk(temp_dir):
-                        for file in files:
-                            if file.startswith(".") or "__MACOSX" in root:
+                    with zipfile.ZipFile(uploaded_zip, "r") as zip_ref:
+                        for info in zip_ref.infolist():
+                            if info.is_dir():
+                                continue
+                            file = os.path.basename(info.filename)
+                            if file.startswith(".") or "__MACOSX" in info.filename:
                                 continue
-
-                            full_path = os.path.join(root, file)
 
                             # ✅ จับไฟล์ชื่อ Database
                             if "DATABASE" in file.upper():
                                 if db_path is None:
-                                    db_path = full_path
-                            else:
-                                source_files.append(os.path.relpath(full_path, temp_dir))
+                                    db_path = zip_ref.extract(info, temp_dir)
+                            elif file.lower().endswith(valid_source_exts):
+                                full_path = zip_ref.extract(info, temp_dir)
+                                source_files.append((full_path, file))
 
                     if not db_path:
                         st.error("❌ ไม่พบไฟล์ Database ใน ZIP (ต้องมีคำว่า 'Database' ในชื่อไฟล์)")
@@ -601,7 +660,7 @@ if uploaded_zip:
                         st.info(f"📍 Found Database: {os.path.basename(db_path)}")
                         st.info(f"📍 Found Source Files: {len(source_files)} files")
 
-                        excel_file, error_msg = process_data_in_memory(db_path, source_files, temp_dir)
+                        excel_file, error_msg = process_data_in_memory(db_path, source_files)
 
                         if error_msg:
                             st.error(error_msg)